@@ -6,10 +6,19 @@ No complex dependencies - uses sentence-transformers + FAISS directly
 from fastapi import FastAPI, HTTPException, Depends, Security
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 import os
+import sys
 import json
+import hashlib
+import pickle
+import time
+import asyncio
+import importlib.util
+import shutil
+from collections import OrderedDict
 import numpy as np
 from datetime import datetime
 import uvicorn
@@ -22,12 +31,32 @@ import faiss
 API_KEY = os.getenv("API_KEY", "your-custom-api-key-here")
 INDEX_PATH = os.getenv("INDEX_PATH", "./simple_index")
 MODEL_NAME = os.getenv("MODEL_NAME", "all-MiniLM-L6-v2")
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "false").lower() == "true"
+ENCODER_BACKEND = os.getenv("ENCODER_BACKEND", "onnx")  # "onnx" (INT8) or "torch"
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", 4096))
+EMBEDDING_CACHE_FILE = os.path.join(INDEX_PATH, "query_embeddings.pkl")
+DOCS_INDEX_FILE = os.path.join(INDEX_PATH, "docs.faiss")
+DOCS_META_FILE = os.path.join(INDEX_PATH, "meta.json")
+DOCS_MATRIX_FILE = os.path.join(INDEX_PATH, "docs.npy")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+# Split the cores between workers; each encoder otherwise starts one thread per core
+ENCODER_THREADS = int(os.getenv("ENCODER_THREADS", max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+MAX_BATCH = int(os.getenv("MAX_BATCH", 32))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", 5))
+ANN_THRESHOLD = int(os.getenv("ANN_THRESHOLD", 10000))  # switch from brute force to HNSW at this size
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 64))
+FAISS_USE_GPU = os.getenv("FAISS_USE_GPU", "false").lower() == "true"
+GPU_MAX_K = 2048  # largest k FAISS GPU search supports
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", 4096))
+QUERY_CACHE_THRESHOLD = float(os.getenv("QUERY_CACHE_THRESHOLD", 0.95))
+QUERY_CACHE_NEIGHBORS = 8  # near neighbours checked for an entry with a matching key
 
 # Initialize FastAPI
 app = FastAPI(
     title="Simple RAG Emigration Service",
     description="Simple, reliable RAG service without complex dependencies",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse
 )
 
 app.add_middleware(
@@ -49,43 +78,410 @@ def verify_api_key(credentials: HTTPAuthorizationCredentials = Security(security
 # Global variables for the simple RAG system
 embedder = None
 index = None
+doc_matrix = None
+gpu_resources = None
 documents = []
-metadata = []
+# Document fields as parallel arrays (struct-of-arrays), indexed by document index
+contents = None
+sources = None
+countries = None
+categories = None
+
+# Per-country partitions: lowercased country -> global document indices / their vectors
+country_idx_map: Dict[str, np.ndarray] = {}
+country_matrix: Dict[str, np.ndarray] = {}
 loading_error = None
+document_store_loaded = False
+ready = False  # set only after every global above is fully initialized
+embedding_cache: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+
+# Semantic cache: past query embeddings -> ((max_results, country, category), RAGResponse)
+query_cache_index = None
+query_cache_embeddings = []
+query_cache_entries = []
+
+class EmbeddingBatcher:
+    """Micro-batches concurrent queries into a single encode call"""
+    
+    def __init__(self, max_batch: int, window_ms: float):
+        self.max_batch = max_batch
+        self.window = window_ms / 1000
+        self.queue = None
+        self.worker = None
+    
+    async def submit(self, text: str) -> np.ndarray:
+        if self.worker is None:
+            self.queue = asyncio.Queue()
+            self.worker = asyncio.create_task(self._run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+    
+    async def _collect(self):
+        """Wait for one query, then gather more until the batch is full or the window closes"""
+        loop = asyncio.get_running_loop()
+        items = [await self.queue.get()]
+        deadline = loop.time() + self.window
+        while len(items) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return items
+    
+    async def _run(self):
+        while True:
+            items = await self._collect()
+            
+            # Sort by length so each encoder batch pads as little as possible
+            items.sort(key=lambda item: len(item[0]))
+            texts = [text for text, _ in items]
+            try:
+                embeddings = await asyncio.to_thread(
+                    embedder.encode,
+                    texts,
+                    batch_size=self.max_batch,
+                    convert_to_numpy=True,
+                    normalize_embeddings=True
+                )
+                for row, (_, future) in zip(embeddings, items):
+                    if not future.done():
+                        # Copy so cached entries do not pin the whole batch buffer
+                        future.set_result(row[None, :].copy())
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+
+batcher = EmbeddingBatcher(MAX_BATCH, BATCH_WINDOW_MS)
+ready_lock = asyncio.Lock()
+
+async def _embed_cached(text: str) -> np.ndarray:
+    """Encode a query, reusing the embedding of identical earlier queries (LRU)"""
+    key = hashlib.sha256(text.encode()).digest()
+    cached = embedding_cache.get(key)
+    if cached is not None:
+        embedding_cache.move_to_end(key)
+        return cached
+    
+    embedding = await batcher.submit(text)
+    embedding_cache[key] = embedding
+    if len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+        embedding_cache.popitem(last=False)
+    return embedding
+
+def _encoder_fingerprint() -> str:
+    """Identify the embedding space cached query vectors belong to"""
+    return f"{MODEL_NAME}:{_encoder_backend_name()}"
+
+def load_embedding_cache():
+    """Pre-warm the query embedding cache from disk"""
+    if not os.path.exists(EMBEDDING_CACHE_FILE):
+        return
+    try:
+        with open(EMBEDDING_CACHE_FILE, "rb") as f:
+            stored = pickle.load(f)
+        if not isinstance(stored, dict) or stored.get("fingerprint") != _encoder_fingerprint():
+            print("Stored query embedding cache is from another encoder, ignoring it")
+            return
+        embedding_cache.update(stored["embeddings"])
+        while len(embedding_cache) > EMBEDDING_CACHE_SIZE:
+            embedding_cache.popitem(last=False)
+        print(f"Loaded {len(embedding_cache)} cached query embeddings")
+    except Exception as e:
+        print(f"⚠️ Could not load query embedding cache: {e}")
+
+def save_embedding_cache():
+    """Persist the query embedding cache so the next start is warm"""
+    try:
+        os.makedirs(INDEX_PATH, exist_ok=True)
+        # Workers all save on shutdown: write privately, then swap in atomically
+        tmp_file = f"{EMBEDDING_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, "wb") as f:
+            pickle.dump({"fingerprint": _encoder_fingerprint(), "embeddings": embedding_cache}, f)
+        os.replace(tmp_file, EMBEDDING_CACHE_FILE)
+    except Exception as e:
+        print(f"⚠️ Could not save query embedding cache: {e}")
+
+class OnnxEncoder:
+    """INT8-quantized ONNX Runtime encoder exposing SentenceTransformer.encode"""
+    
+    def __init__(self, model_name: str, cache_dir: str):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+        import onnxruntime
+        
+        model_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+        model_dir = os.path.join(cache_dir, f"onnx-int8-{model_id.replace('/', '--')}")
+        if not os.path.exists(model_dir):
+            # Export into a private directory and rename it into place, so concurrent
+            # workers never load a half-written model
+            print(f"Exporting {model_name} to ONNX with dynamic INT8 quantization...")
+            tmp_dir = f"{model_dir}.{os.getpid()}.tmp"
+            model = ORTModelForFeatureExtraction.from_pretrained(model_id, export=True)
+            model.save_pretrained(tmp_dir)
+            AutoTokenizer.from_pretrained(model_id).save_pretrained(tmp_dir)
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantizer.quantize(
+                save_dir=tmp_dir,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+            )
+            with open(os.path.join(tmp_dir, "max_seq_length.json"), "w") as f:
+                json.dump({"max_seq_length": self._max_seq_length(model_id)}, f)
+            try:
+                os.rename(tmp_dir, model_dir)
+            except OSError:
+                shutil.rmtree(tmp_dir, ignore_errors=True)  # another worker finished first
+        
+        session_options = onnxruntime.SessionOptions()
+        session_options.intra_op_num_threads = ENCODER_THREADS
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir, file_name="model_quantized.onnx", session_options=session_options
+        )
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        with open(os.path.join(model_dir, "max_seq_length.json")) as f:
+            self.max_seq_length = json.load(f)["max_seq_length"]
+    
+    @staticmethod
+    def _max_seq_length(model_id: str) -> int:
+        """Truncation length sentence-transformers uses for this model (256 for MiniLM)"""
+        from huggingface_hub import hf_hub_download
+        try:
+            with open(hf_hub_download(model_id, "sentence_bert_config.json")) as f:
+                return json.load(f)["max_seq_length"]
+        except Exception:
+            return 256
+    
+    def encode(self, sentences, batch_size: int = 32, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        batches = []
+        for start in range(0, len(sentences), batch_size):
+            inputs = self.tokenizer(
+                sentences[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np"
+            )
+            token_embeddings = self.model(**inputs).last_hidden_state
+            
+            # Mean pooling over real (non-padding) tokens
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            batches.append(pooled)
+        
+        embeddings = np.vstack(batches).astype(np.float32, copy=False)
+        if normalize_embeddings:
+            embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings
+
+def _encoder_backend_name() -> str:
+    """Resolve the encoder backend without loading it, falling back to torch if ONNX is unavailable"""
+    if ENCODER_BACKEND == "onnx":
+        if importlib.util.find_spec("optimum") and importlib.util.find_spec("onnxruntime"):
+            return "onnx-int8"
+    return "torch"
+
+def load_encoder():
+    """Load the query/document encoder, preferring the quantized ONNX backend"""
+    if _encoder_backend_name() == "onnx-int8":
+        return OnnxEncoder(MODEL_NAME, INDEX_PATH)
+    if ENCODER_BACKEND == "onnx":
+        print("⚠️ ONNX Runtime backend unavailable, falling back to sentence-transformers")
+    return SentenceTransformer(MODEL_NAME)
+
+def _index_factory_string(num_docs: int) -> str:
+    """Pick the FAISS index type for a corpus of this size"""
+    if num_docs < ANN_THRESHOLD or FAISS_USE_GPU:
+        return "Flat"  # exact brute force; on GPU this stays fastest at scale
+    return "HNSW32,SQ8"  # 8-bit scalar-quantized storage: 4x less memory and bandwidth
+
+def _documents_fingerprint(docs) -> str:
+    """Identify the model + document set a stored index was built from"""
+    payload = json.dumps({
+        "model": MODEL_NAME,
+        "backend": _encoder_backend_name(),
+        "index": _index_factory_string(len(docs)),
+        "documents": docs
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def load_document_index(docs):
+    """Load the prebuilt FAISS index from disk if it matches the current documents"""
+    if not (os.path.exists(DOCS_INDEX_FILE) and os.path.exists(DOCS_META_FILE)):
+        return None
+    try:
+        with open(DOCS_META_FILE) as f:
+            meta = json.load(f)
+        if meta.get("fingerprint") != _documents_fingerprint(docs):
+            print("Stored index is stale, rebuilding")
+            return None
+        return faiss.read_index(DOCS_INDEX_FILE), meta["documents"]
+    except Exception as e:
+        print(f"⚠️ Could not load stored index: {e}")
+        return None
+
+def save_document_index(doc_index, docs):
+    """Write the FAISS index and its metadata so later starts skip encoding
+    
+    Each file is written privately and swapped in with os.replace, so a process that
+    already has docs.npy mapped keeps the old inode instead of seeing it truncated.
+    """
+    suffix = f".{os.getpid()}.tmp"
+    try:
+        os.makedirs(INDEX_PATH, exist_ok=True)
+        faiss.write_index(doc_index, DOCS_INDEX_FILE + suffix)
+        os.replace(DOCS_INDEX_FILE + suffix, DOCS_INDEX_FILE)
+        if doc_index.ntotal < ANN_THRESHOLD:
+            with open(DOCS_MATRIX_FILE + suffix, "wb") as f:
+                np.save(f, doc_index.reconstruct_n(0, doc_index.ntotal))
+            os.replace(DOCS_MATRIX_FILE + suffix, DOCS_MATRIX_FILE)
+        # Metadata goes last: its fingerprint vouches for the files written above
+        with open(DOCS_META_FILE + suffix, "w") as f:
+            json.dump({"fingerprint": _documents_fingerprint(docs), "documents": docs}, f)
+        os.replace(DOCS_META_FILE + suffix, DOCS_META_FILE)
+    except Exception as e:
+        print(f"⚠️ Could not save index: {e}")
+
+def load_document_matrix(doc_index) -> np.ndarray:
+    """Map the stored (N, D) matrix read-only so all workers share one page-cache copy"""
+    if os.path.exists(DOCS_MATRIX_FILE):
+        try:
+            matrix = np.load(DOCS_MATRIX_FILE, mmap_mode="r")
+            if matrix.shape == (doc_index.ntotal, doc_index.d) and matrix.dtype == np.float32:
+                return matrix
+        except Exception as e:
+            print(f"⚠️ Could not map stored document matrix: {e}")
+    return np.ascontiguousarray(doc_index.reconstruct_n(0, doc_index.ntotal), dtype=np.float32)
+
+def build_document_index(docs):
+    """Encode documents and build the FAISS index"""
+    print("Creating embeddings...")
+    # Encode in length order to minimise padding, then restore document order
+    order = np.argsort([len(doc["content"]) for doc in docs])
+    # Normalized for cosine similarity by the encoder itself
+    encoded = embedder.encode(
+        [docs[i]["content"] for i in order],
+        batch_size=16,
+        convert_to_numpy=True,
+        normalize_embeddings=True
+    )
+    doc_embeddings = np.empty_like(encoded)
+    doc_embeddings[order] = encoded
+    assert doc_embeddings.dtype == np.float32 and doc_embeddings.flags['C_CONTIGUOUS']
+    
+    # Create FAISS index
+    print("Building FAISS index...")
+    dimension = doc_embeddings.shape[1]
+    doc_index = faiss.index_factory(dimension, _index_factory_string(len(docs)), faiss.METRIC_INNER_PRODUCT)
+    if hasattr(doc_index, "hnsw"):
+        doc_index.hnsw.efConstruction = 200
+    
+    if not doc_index.is_trained:
+        doc_index.train(doc_embeddings)
+    doc_index.add(doc_embeddings)
+    return doc_index
+
+def load_document_store(allow_build: bool = True) -> bool:
+    """Load documents, the FAISS index and per-document arrays
+    
+    Starts no encoder thread pools and touches no GPU state, so it is safe to run in
+    the gunicorn master before fork. Building a missing index needs the encoder, so
+    with allow_build=False it returns False instead and leaves that to the workers.
+    """
+    global index, doc_matrix, documents, contents, sources, countries, categories, country_idx_map, country_matrix, query_cache_index, document_store_loaded
+    
+    # Load or create documents, grouped by country so each country is a contiguous row range
+    docs = sorted(get_emigration_documents(), key=lambda doc: (doc.get("country") or "").lower())
+    
+    # Reuse the prebuilt index when available, otherwise encode and store it
+    stored = load_document_index(docs)
+    if stored is not None:
+        print(f"Loaded prebuilt FAISS index from {DOCS_INDEX_FILE}")
+        doc_index, docs = stored
+    elif not allow_build:
+        return False
+    else:
+        doc_index = build_document_index(docs)
+        save_document_index(doc_index, docs)
+    query_cache_index = faiss.IndexFlatIP(doc_index.d)
+    
+    # Small corpora are scored with a plain matmul; large ones go through FAISS
+    if doc_index.ntotal < ANN_THRESHOLD:
+        doc_matrix = load_document_matrix(doc_index)
+        doc_index = None  # the matrix is all the matmul path needs; drop the private FAISS copy
+    elif hasattr(doc_index, "hnsw"):
+        doc_index.hnsw.efSearch = HNSW_EF_SEARCH
+    index = doc_index
+    documents = docs
+    
+    # Store metadata
+    contents = np.array([doc["content"] for doc in documents], dtype=object)
+    sources = np.array([doc.get("source", f"Document {i}") for i, doc in enumerate(documents)], dtype=object)
+    countries = np.array([doc.get("country") for doc in documents], dtype=object)
+    categories = np.array([doc.get("category") for doc in documents], dtype=object)
+    
+    # Partition by country so filtered queries only score that country's documents
+    partitions: Dict[str, List[int]] = {}
+    for i, country in enumerate(countries):
+        if country:
+            partitions.setdefault(country.lower(), []).append(i)
+    country_idx_map = {c: np.array(ids, dtype=np.int64) for c, ids in partitions.items()}
+    if doc_matrix is not None:
+        # Slices are views, so partitions share the (mmapped) matrix instead of copying it
+        country_matrix = {c: doc_matrix[ids[0]:ids[-1] + 1] for c, ids in country_idx_map.items()}
+    
+    document_store_loaded = True
+    return True
 
 def initialize_simple_rag():
     """Initialize simple RAG system"""
-    global embedder, index, documents, metadata, loading_error
+    global embedder, index, gpu_resources, loading_error, ready
     
     try:
-        print(f"Loading sentence transformer: {MODEL_NAME}")
-        embedder = SentenceTransformer(MODEL_NAME)
+        if embedder is None:
+            print(f"Loading sentence transformer: {MODEL_NAME} ({ENCODER_BACKEND})")
+            embedder = load_encoder()
+        if isinstance(embedder, SentenceTransformer):
+            # Thread settings are per process, so apply them after fork
+            import torch
+            torch.set_num_threads(ENCODER_THREADS)
         
-        # Load or create documents
-        documents = get_emigration_documents()
+        if not document_store_loaded:
+            load_document_store()
         
-        # Create embeddings
-        print("Creating embeddings...")
-        doc_embeddings = embedder.encode([doc["content"] for doc in documents])
+        # GPU state is per process, so the index moves to the GPU after fork
+        if index is not None and FAISS_USE_GPU and not hasattr(index, "hnsw") and gpu_resources is None:
+            gpu_resources = faiss.StandardGpuResources()
+            index = faiss.index_cpu_to_gpu(gpu_resources, 0, index)
         
-        # Create FAISS index
-        print("Building FAISS index...")
-        dimension = doc_embeddings.shape[1]
-        index = faiss.IndexFlatIP(dimension)  # Inner product for similarity
+        # Warm up the encoder (allocator pools, thread pools, ORT/oneDNN kernels) so the
+        # first real request doesn't pay for it. Query embeddings are used as-is on the
+        # hot path, so this also checks they are already float32.
+        warmup = embedder.encode(["warmup"] * 4, convert_to_numpy=True, normalize_embeddings=True)
+        assert warmup.dtype == np.float32, f"Encoder returned {warmup.dtype}, expected float32"
         
-        # Normalize embeddings for cosine similarity
-        faiss.normalize_L2(doc_embeddings)
-        index.add(doc_embeddings.astype('float32'))
-        
-        # Store metadata
-        metadata = [doc for doc in documents]
+        load_embedding_cache()
         
+        # Publish readiness last so requests never see a half-built system
+        ready = True
         print(f"✅ Simple RAG initialized with {len(documents)} documents")
         
     except Exception as e:
         loading_error = str(e)
         print(f"❌ Failed to initialize Simple RAG: {e}")
 
+async def _ensure_ready():
+    """Initialize the RAG system once, off the event loop"""
+    if ready or loading_error is not None:
+        return
+    async with ready_lock:
+        if not ready and loading_error is None:
+            await asyncio.to_thread(initialize_simple_rag)
+
 def get_emigration_documents():
     """Get emigration documents for indexing"""
     return [
@@ -158,12 +554,89 @@ class RAGResponse(BaseModel):
     total_results: int
     processing_time_ms: int
 
+def search_documents(query_embedding: np.ndarray, k: int, country: Optional[str] = None):
+    """Return the top-k (scores, indices) for a normalized query, best first
+    
+    When the country has documents, only that country's documents are returned. On
+    the GPU, where FAISS has no ID selectors, the top GPU_MAX_K hits are post-filtered,
+    so a country whose documents all rank below that can return fewer than k results.
+    """
+    country_ids = country_idx_map.get(country.lower()) if country else None
+    
+    if doc_matrix is None:
+        if country_ids is not None and gpu_resources is not None:
+            scores, indices = index.search(query_embedding, min(index.ntotal, GPU_MAX_K))
+            keep = np.isin(indices[0], country_ids)
+            return scores[0][keep][:k], indices[0][keep][:k]
+        
+        params = None
+        if country_ids is not None:
+            selector = faiss.IDSelectorBatch(country_ids)
+            if hasattr(index, "hnsw"):
+                # Explicit params override index.hnsw.efSearch, so carry it over
+                params = faiss.SearchParametersHNSW(sel=selector, efSearch=max(HNSW_EF_SEARCH, k))
+            else:
+                params = faiss.SearchParameters(sel=selector)
+        scores, indices = index.search(query_embedding, k, params=params)
+        found = indices[0] >= 0
+        return scores[0][found], indices[0][found]
+    
+    matrix = doc_matrix if country_ids is None else country_matrix[country.lower()]
+    k = min(k, len(matrix))
+    
+    # One BLAS matvec over the (N, D) matrix, then an O(N) partial top-k;
+    # only the k winners are sorted, and indices are in range by construction
+    scores = matrix @ query_embedding[0]
+    local = np.argpartition(-scores, k - 1)[:k]
+    local = local[np.argsort(-scores[local])]
+    indices = local if country_ids is None else country_ids[local]
+    return scores[local], indices
+
+def lookup_query_cache(query_embedding: np.ndarray, key: tuple) -> Optional[RAGResponse]:
+    """Return a cached response for a near-identical earlier query, if any"""
+    if query_cache_index is None or query_cache_index.ntotal == 0:
+        return None
+    # The nearest entry may belong to another key (e.g. the same query with a different
+    # max_results), so take the closest one above the threshold whose key matches
+    n = min(QUERY_CACHE_NEIGHBORS, query_cache_index.ntotal)
+    scores, indices = query_cache_index.search(query_embedding, n)
+    for score, idx in zip(scores[0], indices[0]):
+        if score < QUERY_CACHE_THRESHOLD:
+            break
+        cached_key, response = query_cache_entries[idx]
+        if cached_key == key:
+            return response
+    return None
+
+def store_query_cache(query_embedding: np.ndarray, key: tuple, response: RAGResponse):
+    """Remember a response; drop the oldest half and rebuild once the cache is full"""
+    global query_cache_embeddings, query_cache_entries
+    if query_cache_index is None:
+        return
+    # Don't store a duplicate of an entry that already answers this key
+    if lookup_query_cache(query_embedding, key) is not None:
+        return
+    if len(query_cache_entries) >= QUERY_CACHE_SIZE:
+        keep = QUERY_CACHE_SIZE // 2
+        query_cache_embeddings = query_cache_embeddings[-keep:]
+        query_cache_entries = query_cache_entries[-keep:]
+        query_cache_index.reset()
+        if query_cache_embeddings:
+            query_cache_index.add(np.vstack(query_cache_embeddings))
+    query_cache_index.add(query_embedding)
+    query_cache_embeddings.append(query_embedding)
+    query_cache_entries.append((key, response))
+
 # API Endpoints
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
-    status = "healthy" if embedder is not None and index is not None else "unhealthy"
-    details = "Simple RAG service operational" if status == "healthy" else f"Initialization failed: {loading_error}"
+    if ready:
+        status, details = "healthy", "Simple RAG service operational"
+    elif loading_error is None:
+        status, details = "loading", "Simple RAG service is initializing"
+    else:
+        status, details = "unhealthy", f"Initialization failed: {loading_error}"
     
     return {
         "status": status,
@@ -180,55 +653,66 @@ async def retrieve_context(
     api_key: str = Depends(verify_api_key)
 ):
     """Retrieve relevant context using simple RAG"""
-    if not embedder or not index:
+    await _ensure_ready()
+    if not ready:
         raise HTTPException(
             status_code=503, 
             detail=f"Simple RAG not initialized: {loading_error}"
         )
     
-    start_time = datetime.now()
+    start_time = time.perf_counter_ns()
     
     try:
-        # Enhance query
-        enhanced_query = request.query
+        # Enhance query; normalized so it doubles as a stable embedding cache key
+        parts = [request.query]
         if request.country:
-            enhanced_query = f"{enhanced_query} {request.country}"
+            parts.append(request.country)
         if request.category and request.category != "general":
-            enhanced_query = f"{enhanced_query} {request.category.replace('_', ' ')}"
+            parts.append(request.category.replace('_', ' '))
+        enhanced_query = " ".join(parts).strip().lower()
         
         # Create query embedding
-        query_embedding = embedder.encode([enhanced_query])
-        faiss.normalize_L2(query_embedding)
+        query_embedding = await _embed_cached(enhanced_query)
+        k = max(1, min(request.max_results or 5, len(documents)))
+        
+        # Serve paraphrases of earlier queries from the semantic cache
+        cache_key = (k, (request.country or "").lower(), (request.category or "general").lower())
+        cached = lookup_query_cache(query_embedding, cache_key)
+        if cached is not None:
+            processing_time = (time.perf_counter_ns() - start_time) // 1_000_000
+            return ORJSONResponse(cached.model_copy(update={
+                "query": request.query,
+                "processing_time_ms": processing_time
+            }).model_dump())
         
         # Search
-        k = min(request.max_results or 5, len(documents))
-        scores, indices = index.search(query_embedding.astype('float32'), k)
+        scores, indices = search_documents(query_embedding, k, request.country)
         
         # Format results
         results = []
-        for i, (score, idx) in enumerate(zip(scores[0], indices[0])):
-            if idx < len(metadata):
-                doc = metadata[idx]
-                results.append(RAGResult(
-                    content=doc["content"],
-                    source=doc.get("source", f"Document {idx}"),
-                    relevance_score=float(score),
-                    metadata={
-                        "country": doc.get("country"),
-                        "category": doc.get("category"),
-                        "rank": i + 1,
-                        "document_index": int(idx)
-                    }
-                ))
+        for i, (score, idx) in enumerate(zip(scores, indices)):
+            results.append(RAGResult(
+                content=contents[idx],
+                source=sources[idx],
+                relevance_score=float(score),
+                metadata={
+                    "country": countries[idx],
+                    "category": categories[idx],
+                    "rank": i + 1,
+                    "document_index": int(idx)
+                }
+            ))
         
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
+        processing_time = (time.perf_counter_ns() - start_time) // 1_000_000
         
-        return RAGResponse(
+        response = RAGResponse(
             results=results,
             query=request.query,
             total_results=len(results),
-            processing_time_ms=int(processing_time)
+            processing_time_ms=processing_time
         )
+        store_query_cache(query_embedding, cache_key, response)
+        return ORJSONResponse(response.model_dump())
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Search failed: {str(e)}")
@@ -238,21 +722,55 @@ async def root():
     """Root endpoint"""
     return {
         "service": "Simple RAG Emigration Service",
-        "status": "healthy" if embedder and index else "unhealthy",
+        "status": "healthy" if ready else "unhealthy",
         "version": "1.0.0-simple",
         "approach": "sentence-transformers + FAISS",
         "docs": "/docs"
     }
 
-# Initialize on startup
+# Under gunicorn --preload this runs once in the master before workers fork, so the
+# documents, index and (torch backend) model weights are shared copy-on-write across
+# workers. Loading SentenceTransformer runs no forward pass, so no thread pools exist
+# yet; each worker warms it up after fork. The ONNX backend cannot share weights: an
+# ORT session's thread pools do not survive fork, so each worker creates its own.
+if PRELOAD_MODEL:
+    try:
+        if not load_document_store(allow_build=False):
+            print("No prebuilt index to preload; workers will build it")
+        if _encoder_backend_name() == "torch":
+            print(f"Preloading sentence transformer: {MODEL_NAME}")
+            embedder = load_encoder()
+    except Exception as e:
+        print(f"⚠️ Could not preload: {e}")
+
+# Initialize the encoder in the background so the service accepts traffic immediately
 @app.on_event("startup")
 async def startup_event():
-    initialize_simple_rag()
+    app.state.init_task = asyncio.create_task(_ensure_ready())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    save_embedding_cache()
 
 if __name__ == "__main__":
+    if "--build-index" in sys.argv:
+        # Build-time step: bake the document index into the image
+        initialize_simple_rag()
+        sys.exit(1 if loading_error else 0)
+    
     print("🚀 Starting Simple RAG Emigration Service...")
     print(f"Model: {MODEL_NAME}")
     print(f"API Key configured: {'Yes' if API_KEY != 'your-custom-api-key-here' else 'No'}")
     
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port, log_level="info")
+    uvicorn.run(
+        "main:app",
+        app_dir=os.path.dirname(os.path.abspath(__file__)),
+        host="0.0.0.0",
+        port=port,
+        workers=WEB_CONCURRENCY,
+        log_level="warning",
+        loop="uvloop",
+        http="httptools",
+        access_log=False
+    )